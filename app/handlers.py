@@ -1,14 +1,17 @@
 # l7rtcp_poc/app/handlers.py
 """Обработчики HTTP-запросов для эндпоинтов L7RTCP."""
 
+import functools
+import sys
 import time
-from typing import List, Optional
+from typing import Dict, List, Mapping, Optional, Tuple
 from fastapi import APIRouter, Header, HTTPException, Request, Response, status
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
 # Импортируем наши модели и хранилище
 from .models import (
-    FeatureToggle, StreamInfo, StreamState, TransmissionState, ResendRequest
+    ChunkIntervals, FeatureToggle, StreamInfo, StreamState, TransmissionState, ResendRequest
 )
 from .storage import storage
 # Импортируем вспомогательные функции
@@ -18,24 +21,142 @@ router = APIRouter()
 
 # --- Вспомогательные функции для парсинга заголовков ---
 
-def parse_features(features_str: str) -> List[FeatureToggle]:
-    """Парсит строку с фичами в список FeatureToggle."""
-    if not features_str:
-        return []
-    try:
-        return [FeatureToggle(f.strip()) for f in features_str.split(',') if f.strip()]
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=f"Invalid feature in X-Features-Supported: {e}")
+# Таблица "значение -> FeatureToggle", строится один раз при импорте.
+# Позволяет не вызывать конструктор Enum (и не ловить ValueError) на каждый запрос.
+_FEATURE_BY_VALUE: Dict[str, FeatureToggle] = {m.value: m for m in FeatureToggle}
 
-def parse_streams(streams_str: Optional[str]) -> List[StreamInfo]:
-    """Парсит строку с потоками в список StreamInfo."""
-    if not streams_str:
-        return []
+# Пробельные символы, которые отбрасываются по краям элементов списка в заголовке.
+_OWS = " \t\r\n"
+
+def _split_comma_trim(s: str) -> List[str]:
+    """
+    Разбивает значение заголовка по запятым, отбрасывая пробелы по краям и пустые элементы.
+    Проходит строку один раз по индексам и создает срез только для итогового элемента,
+    без промежуточных строк от split()/strip().
+    Каждый символ просматривается не более двух раз, поэтому время разбора линейно
+    при любом (в т.ч. враждебном) значении заголовка. Регулярные выражения здесь
+    (и для будущей валидации суб-тегов вроде "video;res=480") не используем,
+    чтобы не получить backtracking и ReDoS.
+    """
+    tokens: List[str] = []
+    length = len(s)
+    pos = 0
+    while pos <= length:
+        end = s.find(',', pos)
+        if end < 0:
+            end = length
+        a = pos
+        b = end
+        while a < b and s[a] in _OWS:
+            a += 1
+        while b > a and s[b - 1] in _OWS:
+            b -= 1
+        if a < b:
+            tokens.append(s[a:b])
+        pos = end + 1
+    return tokens
+
+@functools.lru_cache(maxsize=1024)
+def _parse_features_cached(features_str: str) -> Tuple[FeatureToggle, ...]:
+    """
+    Разбирает непустую строку X-Features-Supported в кортеж FeatureToggle.
+    Результат кешируется по исходной строке: клиент повторяет один и тот же заголовок
+    на каждом /init, а многие клиенты присылают одинаковые наборы фич.
+    Ошибки (HTTPException) не кешируются.
+    """
+    features: List[FeatureToggle] = []
+    for token in _split_comma_trim(features_str):
+        feature = _FEATURE_BY_VALUE.get(token)
+        if feature is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid feature in X-Features-Supported: '{token}' is not a valid FeatureToggle"
+            )
+        features.append(feature)
+    return tuple(features)
+
+@functools.lru_cache(maxsize=1024)
+def _parse_streams_cached(streams_str: str) -> Tuple[StreamInfo, ...]:
+    """
+    Разбирает непустую строку X-Streams в кортеж StreamInfo.
+    Кешируется аналогично _parse_features_cached; возвращаемые объекты общие
+    для всех запросов, поэтому изменять их нельзя.
+    ID потоков интернируются: они хранятся как ключи TransmissionState.streams
+    и повторяются во всех передачах с тем же X-Streams.
+    """
     try:
-        return [StreamInfo(id=s.strip()) for s in streams_str.split(',') if s.strip()]
+        return tuple(StreamInfo(id=sys.intern(token)) for token in _split_comma_trim(streams_str))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid format in X-Streams: {e}")
 
+def parse_features(features_str: str) -> Tuple[FeatureToggle, ...]:
+    """Парсит строку с фичами в кортеж FeatureToggle."""
+    if not features_str:
+        return ()
+    return _parse_features_cached(features_str)
+
+def parse_streams(streams_str: Optional[str]) -> Tuple[StreamInfo, ...]:
+    """Парсит строку с потоками в кортеж StreamInfo."""
+    if not streams_str:
+        return ()
+    return _parse_streams_cached(streams_str)
+
+# --- Константы согласования на /init ---
+
+# Допустимые значения X-Session-Type.
+_VALID_SESSION_TYPES = frozenset(("stateful", "stateless"))
+
+# Фичи, которые мы планируем поддерживать в PoC
+# и которые не требуют сложной логики на данном этапе.
+_POC_FEATURES = frozenset((
+    FeatureToggle.RESEND,
+    FeatureToggle.TTL,
+    FeatureToggle.MULTISTREAM,
+    FeatureToggle.PULL, # Хотя pull опциональный, логика PoC построена на нем
+    # FeatureToggle.BACKPRESSURE, # Пока не реализуем
+    # FeatureToggle.PAUSE, # Пока не реализуем
+    # FeatureToggle.STATELESS, # Пока не реализуем
+    # FeatureToggle.FEC, # Пока не реализуем
+    # FeatureToggle.METRICS, # Пока не реализуем
+))
+
+# --- Фиктивные данные чанков ---
+
+# Размер чанка по умолчанию (если клиент не прислал X-Chunk-Size).
+_DEFAULT_CHUNK_SIZE = 4096
+# Максимальный размер чанка, который сервер готов согласовать.
+_MAX_CHUNK_SIZE = 1 << 20
+
+@functools.lru_cache(maxsize=32)
+def _chunk_payload(size: int) -> bytes:
+    """
+    Возвращает фиктивные данные чанка заданного размера.
+    Объекты общие для всех передач с одинаковым размером чанка.
+    """
+    return b"A" * size
+
+# --- Ответ /transmit с заранее подготовленными заголовками ---
+
+# Заголовки ответа на запрос чанка уже в виде байтов ASGI (имена в нижнем регистре).
+_TRANSMIT_HEADERS: List[Tuple[bytes, bytes]] = [
+    (b"x-backpressure-advice", b"low"),
+    (b"content-type", b"application/octet-stream"),
+]
+
+class _ChunkResponse(Response):
+    """
+    Ответ с данными чанка. Вместо построения заголовков из словаря
+    берет готовый список _TRANSMIT_HEADERS и добавляет только Content-Length.
+    Свои заголовки не принимает.
+    """
+
+    def init_headers(self, headers: Optional[Mapping[str, str]] = None) -> None:
+        if headers is not None:
+            raise TypeError("_ChunkResponse uses fixed headers and does not accept 'headers'")
+        self.raw_headers = _TRANSMIT_HEADERS + [
+            (b"content-length", str(len(self.body)).encode("latin-1"))
+        ]
+
 # --- Обработчики эндпоинтов ---
 
 @router.post("/l7rtcp/init")
@@ -59,7 +180,7 @@ async def init_transmission(
     streams_requested = parse_streams(x_streams)
     
     # 2. Валидация обязательных параметров
-    if x_session_type not in ["stateful", "stateless"]:
+    if x_session_type not in _VALID_SESSION_TYPES:
         raise HTTPException(status_code=400, detail="X-Session-Type must be 'stateful' or 'stateless'")
     
     # 3. Определяем или генерируем X-Transmission-ID
@@ -73,7 +194,7 @@ async def init_transmission(
         is_new_transmission = True
     else:
         # Проверяем, существует ли передача с таким ID
-        existing_transmission = await storage.get(transmission_id)
+        existing_transmission = storage.get(transmission_id)
         if existing_transmission:
             # Это попытка возобновления
             # TODO: Проверить X-Client-ID, если он был сохранен
@@ -88,48 +209,47 @@ async def init_transmission(
     # 4. Согласование возможностей (упрощенная логика для PoC)
     # В реальности сервер должен проверять, какие фичи он поддерживает.
     # Пока что включаем все, что клиент запросил, кроме тех, которые требуют специальной логики.
-    features_enabled = [FeatureToggle.CORE] # Core всегда включен
-    
-    # Включаем те фичи из запрошенных, которые мы планируем поддерживать в PoC
-    # и которые не требуют сложной логики на данном этапе.
-    supported_features_for_poc = {
-        FeatureToggle.RESEND,
-        FeatureToggle.TTL,
-        FeatureToggle.MULTISTREAM,
-        FeatureToggle.PULL, # Хотя pull опциональный, логика PoC построена на нем
-        # FeatureToggle.BACKPRESSURE, # Пока не реализуем
-        # FeatureToggle.PAUSE, # Пока не реализуем
-        # FeatureToggle.STATELESS, # Пока не реализуем
-        # FeatureToggle.FEC, # Пока не реализуем
-        # FeatureToggle.METRICS, # Пока не реализуем
-    }
-    
-    for feature in features_supported:
-        if feature in supported_features_for_poc:
-            features_enabled.append(feature)
+    # Core всегда включен; к нему добавляем те фичи из запрошенных, которые мы
+    # планируем поддерживать в PoC (см. _POC_FEATURES), сохраняя порядок клиента.
+    features_enabled = [FeatureToggle.CORE] + [f for f in features_supported if f in _POC_FEATURES]
     
+    # Размер чанка задает клиент, а данные чанка живут все время сессии,
+    # поэтому ограничиваем его сверху.
+    if x_chunk_size is not None and x_chunk_size > _MAX_CHUNK_SIZE:
+        x_chunk_size = _MAX_CHUNK_SIZE
+
     # 5. Подготавливаем потоки
-    stream_states = {}
+    stream_states: Dict[str, StreamState] = {}
     if streams_requested:
         for stream_info in streams_requested:
-            stream_states[stream_info.id] = StreamState(id=stream_info.id)
+            stream_states[stream_info.id] = StreamState(stream_info.id)
     
     # 6. Создаем или обновляем состояние передачи
     if is_new_transmission or not existing_transmission:
         # Создаем новую передачу
+        now = time.time()
         transmission_state = TransmissionState(
-            id=transmission_id,
-            client_id=x_client_id,
+            transmission_id,
+            x_client_id,
+            features_enabled,
+            now, # created_at
+            now, # last_received_time: инициализируем временем создания
+            x_session_type,
             streams=stream_states,
-            features_enabled=features_enabled,
             ttl_seconds=x_ttl,
-            created_at=time.time(),
-            last_received_time=time.time(), # Инициализируем временем создания
-            session_type=x_session_type,
             max_packet_size=x_max_packet_size,
-            chunk_size=x_chunk_size
+            chunk_size=x_chunk_size,
+            # Заголовки ответа вычисляем один раз при создании сессии.
+            features_enabled_header=",".join(f.value for f in features_enabled),
+            accepted_streams_header=",".join(s.id for s in streams_requested)
         )
-        await storage.create(transmission_state)
+        # Фиктивные данные чанка одинаковы для всей передачи: bytes неизменяемы,
+        # поэтому берем общий объект нужного размера и отдаем его по ссылке на каждый /transmit.
+        chunk_size = x_chunk_size or _DEFAULT_CHUNK_SIZE
+        if x_max_packet_size and chunk_size > x_max_packet_size:
+            chunk_size = x_max_packet_size
+        transmission_state.chunk_payload = _chunk_payload(max(chunk_size, 0))
+        storage.create(transmission_state)
     else:
         # Возобновляем существующую передачу
         # В реальности нужно проверить совместимость параметров
@@ -137,18 +257,18 @@ async def init_transmission(
         existing_transmission.last_received_time = time.time()
         # Можно также обновить список фич, если клиент запросил новые
         # Но для простоты оставим как есть
-        await storage.update(existing_transmission)
+        storage.mark_dirty(existing_transmission.id)
         transmission_state = existing_transmission
 
     # 7. Формируем ответ
     response_headers = {
         "X-Transmission-ID": transmission_state.id,
-        "X-Features-Enabled": ",".join([f.value for f in features_enabled]),
+        "X-Features-Enabled": transmission_state.features_enabled_header,
     }
     
     # Добавляем опциональные заголовки в ответ
-    if streams_requested:
-        response_headers["X-Accepted-Streams"] = ",".join([s.id for s in streams_requested])
+    if transmission_state.accepted_streams_header:
+        response_headers["X-Accepted-Streams"] = transmission_state.accepted_streams_header
     if transmission_state.ttl_seconds:
         response_headers["X-TTL"] = str(transmission_state.ttl_seconds)
     if transmission_state.max_packet_size:
@@ -173,7 +293,7 @@ async def transmit_chunk(
     так и команды управления потоками (с X-Stream-Control).
     """
     # --- 1. Проверяем существование передачи ---
-    transmission_state = await storage.get(x_transmission_id)
+    transmission_state = storage.get(x_transmission_id)
     if not transmission_state:
         raise HTTPException(status_code=404, detail="Transmission not found")
 
@@ -201,42 +321,36 @@ async def transmit_chunk(
     elif x_stream_id is not None and x_packet_id is not None:
         # --- Это логика из оригинального transmit_chunk ---
         
-        # 1. Проверяем существование потока
-        if x_stream_id not in transmission_state.streams:
+        # 1. Проверяем существование потока (линейный поиск по кортежу ID потоков)
+        try:
+            stream_index = transmission_state.stream_ids.index(x_stream_id)
+        except ValueError:
             raise HTTPException(status_code=400, detail=f"Stream '{x_stream_id}' not found in transmission")
+        stream_state = transmission_state.stream_states[stream_index]
+        if not 0 <= x_packet_id < ChunkIntervals.MAX_CHUNKS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"X-Packet-ID must be in range [0, {ChunkIntervals.MAX_CHUNKS})"
+            )
 
         # 2. Проверяем, не истекло ли TTL (если оно было согласовано)
+        now = time.time()
         if transmission_state.ttl_seconds:
-            elapsed_time = time.time() - transmission_state.created_at
+            elapsed_time = now - transmission_state.created_at
             if elapsed_time > transmission_state.ttl_seconds:
                 raise HTTPException(status_code=410, detail="Transmission expired (TTL)")
 
-        # 3. Генерируем фиктивные данные чанка
-        chunk_size = transmission_state.chunk_size or 4096
-        if transmission_state.max_packet_size and chunk_size > transmission_state.max_packet_size:
-            chunk_size = transmission_state.max_packet_size
-        fake_data = b"A" * chunk_size
-
-        # 4. Обновляем состояние передачи: отмечаем, что чанк "отправлен"
-        stream_state = transmission_state.streams[x_stream_id]
+        # 3. Обновляем состояние передачи: отмечаем, что чанк "отправлен"
         stream_state.received_chunks.add(x_packet_id)
-        transmission_state.last_received_time = time.time()
-        await storage.update(transmission_state)
-
-        # 5. Определяем код ответа (пока всегда 209)
-        response_status_code = 209 # 209 Pending Transmission
+        transmission_state.last_received_time = now
+        # Сообщаем хранилищу об изменении на месте (для in-memory хранилища - no-op)
+        storage.mark_dirty(transmission_state.id)
 
-        # 6. Формируем заголовки ответа
-        response_headers = {
-            "X-Backpressure-Advice": "low"
-        }
-
-        # 7. Возвращаем данные чанка в теле ответа
-        return Response(
-            content=fake_data,
-            status_code=response_status_code,
-            headers=response_headers,
-            media_type="application/octet-stream"
+        # 4. Возвращаем фиктивные данные чанка, подготовленные на /init (пока всегда 209).
+        # Заголовки (X-Backpressure-Advice и т.д.) задает _ChunkResponse.
+        return _ChunkResponse(
+            content=transmission_state.chunk_payload,
+            status_code=209 # 209 Pending Transmission
         )
 
     # Сценарий 3: Некорректный набор заголовков
@@ -273,7 +387,7 @@ async def get_transmission_status(
     Возвращает информацию о состоянии передачи.
     """
     # 1. Получаем состояние передачи
-    transmission_state = await storage.get(transmission_id)
+    transmission_state = storage.get(transmission_id)
     if not transmission_state:
         raise HTTPException(status_code=404, detail="Transmission not found")
 
@@ -283,8 +397,10 @@ async def get_transmission_status(
     #     raise HTTPException(status_code=403, detail="Forbidden")
 
     # 3. Генерируем и возвращаем статус
-    # Метод get_status() уже реализован в модели TransmissionState
-    return transmission_state.get_status()
+    # Метод to_status_dict() уже реализован в модели TransmissionState.
+    # Словарь содержит только str/int/float/bool/list, поэтому отдаем его напрямую
+    # в orjson, минуя jsonable_encoder.
+    return ORJSONResponse(transmission_state.to_status_dict(time.time()))
 
 @router.post("/l7rtcp/resend/{transmission_id}")
 async def resend_chunks(
@@ -297,7 +413,7 @@ async def resend_chunks(
     Позволяет клиенту запросить повторную отправку пропущенных чанков.
     """
     # 1. Проверяем существование передачи
-    transmission_state = await storage.get(transmission_id)
+    transmission_state = storage.get(transmission_id)
     if not transmission_state:
         raise HTTPException(status_code=404, detail="Transmission not found")
 
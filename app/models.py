@@ -1,10 +1,11 @@
 # l7rtcp_poc/app/models.py
 # Этот файл определяет основные структуры данных для L7RTCP PoC.
 
-from pydantic import BaseModel, Field
+import bisect
+from dataclasses import dataclass, field
+from pydantic import BaseModel
 from enum import Enum
-from typing import List, Dict, Optional, Set
-import time # Для работы с временными метками
+from typing import List, Dict, Optional, Tuple
 
 # --- Определение Feature Toggles ---
 
@@ -36,35 +37,93 @@ class StreamInfo(BaseModel):
 
 # --- Внутренние структуры данных сервера ---
 
-class StreamState(BaseModel):
+class ChunkIntervals:
+    """
+    Множество полученных чанков в виде отсортированного списка непересекающихся
+    полуинтервалов [start, end). Клиенты получают чанки в основном по порядку,
+    поэтому длинная непрерывная серия хранится одним кортежем, а не
+    отдельным элементом на каждый чанк.
+    """
+    __slots__ = ("_intervals",)
+
+    # Верхняя граница числа чанков в потоке. Интервалы хранят любой ID за O(1),
+    # но /status перечисляет все чанки от 0 до максимального (полученные и
+    # пропущенные), поэтому одним X-Packet-ID клиент задает размер ответа /status.
+    # При 65536 чанках это не больше ~400 КБ JSON и пары миллисекунд на поток.
+    MAX_CHUNKS = 1 << 16
+
+    def __init__(self) -> None:
+        # Отсортированы по start; соседние интервалы не соприкасаются (всегда слиты).
+        self._intervals: List[Tuple[int, int]] = []
+
+    def _index(self, chunk_id: int) -> int:
+        """Индекс последнего интервала со start <= chunk_id (или -1)."""
+        # (chunk_id + 1,) меньше любого кортежа (chunk_id + 1, end),
+        # но больше всех кортежей с start <= chunk_id.
+        return bisect.bisect_right(self._intervals, (chunk_id + 1,)) - 1
+
+    def add(self, chunk_id: int) -> None:
+        """Отмечает чанк как полученный, сливая соседние интервалы."""
+        intervals = self._intervals
+        i = self._index(chunk_id)
+        if i >= 0 and intervals[i][1] > chunk_id:
+            return # Уже получен
+        merge_left = i >= 0 and intervals[i][1] == chunk_id
+        merge_right = i + 1 < len(intervals) and intervals[i + 1][0] == chunk_id + 1
+        if merge_left and merge_right:
+            intervals[i] = (intervals[i][0], intervals[i + 1][1])
+            del intervals[i + 1]
+        elif merge_left:
+            intervals[i] = (intervals[i][0], chunk_id + 1)
+        elif merge_right:
+            intervals[i + 1] = (chunk_id, intervals[i + 1][1])
+        else:
+            intervals.insert(i + 1, (chunk_id, chunk_id + 1))
+
+    def received_and_missing(self) -> Tuple[List[int], List[int]]:
+        """
+        За один проход по интервалам возвращает отсортированные списки
+        полученных чанков и пропущенных чанков от 0 до максимального полученного.
+        """
+        received: List[int] = []
+        missing: List[int] = []
+        prev_end = 0
+        for start, end in self._intervals:
+            missing.extend(range(prev_end, start))
+            received.extend(range(start, end))
+            prev_end = end
+        return received, missing
+
+@dataclass(slots=True)
+class StreamState:
     """
     Внутреннее состояние одного логического потока внутри передачи.
     Хранит информацию о полученных чанках.
     В PoC "полученные" чанки = "отправленные" чанки.
+    Обычный dataclass со __slots__ вместо BaseModel: объект создается на /init
+    и изменяется на каждом /transmit, валидация Pydantic здесь не нужна.
     """
     # Идентификатор потока (например, "video;res=480").
     id: str
-    # Множество ID отправленных чанков. Используем множество для быстрого поиска.
+    # Интервалы ID отправленных чанков.
     # TODO: В реальном сервере нужно разделить "отправленные" и "подтверждённые получения"
-    received_chunks: Set[int] = Field(default_factory=set)
+    received_chunks: ChunkIntervals = field(default_factory=ChunkIntervals)
     # Общее количество чанков в потоке (если известно).
     total_chunks: Optional[int] = None
 
-class TransmissionState(BaseModel):
+@dataclass(slots=True)
+class TransmissionState:
     """
     Внутреннее состояние одной сессии передачи данных.
     Это основная структура, которую сервер хранит в памяти.
+    Как и StreamState, это dataclass со __slots__, а не BaseModel.
     """
     # Уникальный идентификатор передачи (X-Transmission-ID).
     id: str
     # Идентификатор клиента (X-Client-ID).
     client_id: str
-    # Словарь состояний потоков. Ключ - ID потока, значение - StreamState.
-    streams: Dict[str, StreamState] = Field(default_factory=dict)
     # Список фич, согласованных и включенных для этой сессии.
     features_enabled: List[FeatureToggle]
-    # Время жизни сессии в секундах (если согласовано).
-    ttl_seconds: Optional[int] = None
     # Временная метка создания сессии (timestamp).
     created_at: float
     # Временная метка последнего получения данных (timestamp).
@@ -72,30 +131,45 @@ class TransmissionState(BaseModel):
     last_received_time: float
     # Тип сессии: "stateful" или "stateless".
     session_type: str # "stateful" | "stateless"
+    # Словарь состояний потоков. Ключ - ID потока, значение - StreamState.
+    streams: Dict[str, StreamState] = field(default_factory=dict)
+    # Время жизни сессии в секундах (если согласовано).
+    ttl_seconds: Optional[int] = None
     # Максимальный размер пакета, согласованный в хендшейке.
     max_packet_size: Optional[int] = None
     # Размер чанка, согласованный в хендшейке.
     chunk_size: Optional[int] = None
+    # Готовое значение заголовка X-Features-Enabled (фичи через запятую).
+    features_enabled_header: str = ""
+    # Готовое значение заголовка X-Accepted-Streams (пустая строка, если потоков нет).
+    accepted_streams_header: str = ""
+    # Фиктивные данные чанка, выделяемые один раз на /init и отдаваемые на /transmit.
+    chunk_payload: bytes = field(default=b"", repr=False)
+    # Те же потоки в виде параллельных массивов для горячего пути /transmit:
+    # при 2-5 потоках линейный поиск tuple.index() (цикл в C по коротким
+    # строкам) дешевле хеширования. Строятся из streams
+    # в __post_init__; сам набор потоков после создания передачи не меняется.
+    stream_ids: Tuple[str, ...] = field(init=False, repr=False)
+    stream_states: List[StreamState] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.stream_ids = tuple(self.streams)
+        self.stream_states = list(self.streams.values())
 
     # Метод для получения статуса передачи в формате, подходящем для /status.
-    def get_status(self) -> dict:
+    def to_status_dict(self, now: float) -> dict:
         """
         Генерирует словарь со статусом передачи для эндпоинта /l7rtcp/status.
+        now - текущее время (timestamp) для проверки TTL.
         """
-        status_streams = {}
+        status_streams: Dict[str, dict] = {}
         for stream_id, stream_state in self.streams.items():
-            # Преобразуем множество в отсортированный список.
-            received_list = sorted(list(stream_state.received_chunks))
-            
             # Простая логика определения пропущенных чанков.
             # Предполагаем, что чанки идут последовательно от 0 до максимума полученных.
             # Это упрощение; в реальном случае нужно знать total_chunks или
             # использовать более сложную логику.
-            max_received = max(received_list) if received_list else -1
-            missing_list = sorted(
-                list(set(range(max_received + 1)) - stream_state.received_chunks)
-            ) if max_received >= 0 else []
-            
+            received_list, missing_list = stream_state.received_chunks.received_and_missing()
+
             status_streams[stream_id] = {
                 "received": received_list,
                 "missing": missing_list,
@@ -105,7 +179,7 @@ class TransmissionState(BaseModel):
         # Проверяем, жива ли еще передача (по TTL)
         alive = True
         if self.ttl_seconds:
-            elapsed_time = time.time() - self.created_at
+            elapsed_time = now - self.created_at
             alive = elapsed_time <= self.ttl_seconds
             
         return {
@@ -1,14 +1,16 @@
 # l7rtcp_poc/app/storage.py
 # Этот файл реализует простое in-memory хранилище для состояний передач (TransmissionState).
 
-import asyncio
 from typing import Dict, Optional
 from .models import TransmissionState
 
 class InMemoryTransmissionStorage:
     """
     Простое in-memory хранилище для состояний передач.
-    Использует словарь для хранения и asyncio.Lock для обеспечения потокобезопасности.
+    Использует словарь для хранения без дополнительных блокировок: все операции
+    сводятся к одиночным операциям над dict со строковыми ключами, которые атомарны
+    в CPython (GIL), а обработчики выполняются в одном event loop.
+    Методы синхронные, чтобы не тратить лишний переход через event loop на каждый вызов.
     """
 
     def __init__(self):
@@ -18,51 +20,40 @@ class InMemoryTransmissionStorage:
         # Словарь для хранения состояний передач.
         # Ключ: X-Transmission-ID, Значение: TransmissionState.
         self._store: Dict[str, TransmissionState] = {}
-        # Асинхронная блокировка для предотвращения гонок данных
-        # при одновременном доступе из разных запросов.
-        self._lock = asyncio.Lock()
 
-    async def create(self, transmission: TransmissionState) -> None:
+    def create(self, transmission: TransmissionState) -> None:
         """
         Создает новую запись о передаче в хранилище.
         Если передача с таким ID уже существует, она будет перезаписана.
         """
-        async with self._lock:
-            # Простая реализация: перезаписываем существующую запись.
-            # В более сложной логике можно проверять конфликты.
-            self._store[transmission.id] = transmission
+        # Простая реализация: перезаписываем существующую запись.
+        # В более сложной логике можно проверять конфликты.
+        self._store[transmission.id] = transmission
 
-    async def get(self, transmission_id: str) -> Optional[TransmissionState]:
+    def get(self, transmission_id: str) -> Optional[TransmissionState]:
         """
         Получает состояние передачи по её ID.
         Возвращает TransmissionState или None, если передача не найдена.
         """
-        async with self._lock:
-            # Возвращаем копию или ссылку на объект.
-            # В данном случае возвращаем ссылку.
-            return self._store.get(transmission_id)
+        # Возвращаем копию или ссылку на объект.
+        # В данном случае возвращаем ссылку.
+        return self._store.get(transmission_id)
 
-    async def update(self, transmission: TransmissionState) -> bool:
+    def delete(self, transmission_id: str) -> bool:
         """
-        Обновляет существующую запись о передаче.
-        Возвращает True, если запись была обновлена, False, если не найдена.
+        Удаляет запись о передаче из хранилища.
+        Возвращает True, если запись была удалена, False, если не найдена.
         """
-        async with self._lock:
-            if transmission.id in self._store:
-                self._store[transmission.id] = transmission
-                return True
-            return False
+        return self._store.pop(transmission_id, None) is not None
 
-    async def delete(self, transmission_id: str) -> bool:
+    def mark_dirty(self, transmission_id: str) -> None:
         """
-        Удаляет запись о передаче из хранилища.
-        Возвращает True, если запись была удалена, False, если не найдена.
+        Сообщает хранилищу, что передача была изменена на месте.
+        Для in-memory хранилища изменения уже видны через общую ссылку на объект,
+        поэтому метод ничего не делает. Это точка расширения для внешнего
+        хранилища (Redis, БД), которое сможет накапливать такие ID
+        и записывать их пачкой, не задерживая горячий путь /transmit.
         """
-        async with self._lock:
-            if transmission_id in self._store:
-                del self._store[transmission_id]
-                return True
-            return False
 
 # Создаем глобальный экземпляр хранилища, который будет использоваться всем приложением.
-storage = InMemoryTransmissionStorage()
\ No newline at end of file
+storage = InMemoryTransmissionStorage()